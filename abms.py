@@ -1,188 +1,67 @@
-import pandas as pd
-import math
-import numpy as np
 import dash
 from dash import dcc
 from dash import html
 # from dash import dbc
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
-import plotly.express as px
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from statistics import mean
 import time
+import uuid
+import flask
 from dash import dash_table
 from dash.exceptions import PreventUpdate
+from cache import ResultCache
+from charts import chartData
+from jobs import JobQueue, WorkerPool
+from metrics import Registry, addHook, debug, timed
+from simulation import KANOTYPES, DIRECTIONS, MIN_AGENTS, Product, Attribute, SampleCache, Simulation, Replications, sweep, runScenario, optimizeScenario
 start_time = time.time()  # tracks execution time
 
-KANOTYPES = ['basic', 'satisfier', 'delighter'] # kano types
-
-DIRECTIONS = ["higher is better", "lower is better"] # indicates reversed kano types
-
 # bootstrap style sheet
 app = dash.Dash(external_stylesheets=[dbc.themes.SOLAR])
 server = app.server
 
-# ---------------
-
-
-class Consumer:
-    def __init__(self, stdevs, weights, kanotypes, direction, monthsPerTick):
-        self.setPreferences(stdevs, weights)
-        self.bestProducer = 0
-        self.kanotypes = kanotypes
-        self.direction = direction
-        self.ownedProductRemainingLifespan = 0
-        self.monthsPerTick = monthsPerTick
-
-    def setPreferences(self, stdevs, weights):  # creates consumer preferences
-        self.preferences = []
-        for stdev, weight in zip(stdevs.values, weights.values):
-            weightedPreference = np.random.lognormal(
-                sigma=float(stdev), mean=1) * float(weight) # weighted preference with degree of randomness
-            self.preferences.append(weightedPreference)
-
-    def pickTopProduct(self, products): # kano type formulas
-        def calculateUtilityScore(attribute, preference, kanotype, direction):
-            attribute = float(attribute)
-            score = 0
-            
-            if direction == "lower is better":
-    
-                if kanotype == 'basic': # reversed kano types
-                    score = preference * (0 - math.e ** (2 * attribute - 1))
-                elif kanotype == 'satisfier':
-                    score = -preference * attribute
-                elif kanotype == 'delighter':
-                    score = preference * math.e ** (-2 * attribute - 1)
-            else: # normal kano types
-                if kanotype == 'basic':
-                    score = preference * (0 - math.e ** (-2 * attribute - 1))
-                elif kanotype == 'satisfier':
-                    score = preference * attribute
-                elif kanotype == 'delighter':
-                    score = preference * math.e ** (2 * attribute - 1)
-
-            return score
-       
-
-        if self.ownedProductRemainingLifespan > 0:
-            self.ownedProductRemainingLifespan -= self.monthsPerTick
-            
-        else:
-            # utility score calculation
-            result = {}
-            for idx, product in enumerate(products): # splitting the 1st value to idx, 2nd to product
-                sum = 0
-                for attribute, preference, kanotype, direction in zip(product.valueList, self.preferences, self.kanotypes, self.direction): # loop through all at same time in parallel
-                    sum += calculateUtilityScore(attribute, preference, kanotype, direction)  # figures out score based on kanotype
-                result[idx] = sum # once the score is found, consumer gets list of all products and how they are scored
-
-            chosenIdx = max(result, key=result.get) # consumer choice of product that has best score
-            products[chosenIdx].buy() # consumers buy product
-            self.ownedProductRemainingLifespan = products[chosenIdx].lifespan  - np.random.exponential()
-            self.bestProducer = chosenIdx
-
-class Product:
-    def __init__(self, valueList, name):
-        self.name = name
-        self.profit = 0 # total profit accumulated for new product (starting with no profit)
-        self.monthlySales = 0
-        self.sales = 0  # The total amount of products that have been sold
-        self.price = valueList[1]  # The price of the product
-        self.productioncost = 0
-        self.valueList = valueList
-        self.lifespan = float(valueList[0]) 
-        self.remainingLifespan = 0
-
-    def buy(self):
-        self.sales += 1
-        self.monthlySales += 1
-        self.remainingLifespan = 0
-    
-    def resetmonthlySales(self): # remove?
-        self.monthlySales = 0
-
-
-
+cache = ResultCache() # results of seeded runs, shared by every worker on the host
 
-class Attribute:
-    def __init__(self, name, kano, direction, stdev, weight): # data table columns, product attributes
-        self.name = name
-        self.kanotype = kano
-        self.direction = direction
-        self.stdev = stdev
-        self.weight = weight
+registry = Registry() # phase timings from the web and job worker processes, exported at /metrics
+addHook(registry.observe)
 
-    def setkanotype(self, type):
-        self.kanotype = type
-
-
-class Simulation:
-    def __init__(self, table, consumers, months, cost, monthsPerTick):
-        self.df = table
-        self.consumers = consumers  # number of consumers
-        self.months = months  # number of months in simulation
-        self.cost = cost
-        self.monthsPerTick = monthsPerTick
-        self.ticks = int(months/monthsPerTick) # prevents non integer months
-
-        self.profitPerSale = int(self.df.iat[1, 5]) - self.cost # profit calculation
-
-        self.attributeDF = self.df.iloc[:, 0:5] # splits data table into attributes dataframe
-
-        self.productDF = self.df.iloc[:, 5:] # splits data table into product dataframe
-
-        self.setAttributes() # set attributes
-        self.setProducts() # set producers
+# ---------------
 
-        self.profitDF = {'Time (Months)': [], 'Profit ($)': []} # dict with time and profit for graphing
 
-        self.noncumulativeprofitDF = {'Time (Months)': [], 'Profit ($)': []} # dict with time and non cumulative profit for graphing
+def scenarioKey(params): # cache key of a seeded run submitted from the app
+    return ResultCache.key(params['table'], params['columns'], params['consumers'], params['months'],
+                           params['monthsPerTick'], params['cost'], params['seed'], params['agents'], params['optimize'])
 
-        self.consumers = [Consumer(
-                self.df['Spread'], self.df['Weight'], self.df['Kanotype'], self.df['Direction'], self.monthsPerTick) for _ in range(consumers)] # for amount of customers specified
 
-        for i in range(self.ticks): # loop that runs every tick
-            for consumer in self.consumers:
-                consumer.pickTopProduct(self.products) # for every consumer in the list, calls pickTopProduct with list of products in the simulation
-            self.profitDF['Time (Months)'].append(i*self.monthsPerTick) # sets month for x axis on graph
-            self.profitDF['Profit ($)'].append(self.products[0].sales * self.profitPerSale) # sets profit for y axis
-            # -------------------------
-            self.noncumulativeprofitDF['Time (Months)'].append(i*self.monthsPerTick) # sets month for x axis on graph
-            self.noncumulativeprofitDF['Profit ($)'].append(self.products[0].monthlySales * self.profitPerSale) # sets profit for y axis
-            self.products[0].resetmonthlySales()
-            # --------------------------
+def runJob(params, progress): # background job handler, runs in a worker process
+    params = dict(params)
+    session = params.pop('session', None)
+    optimize = params.pop('optimize', False)
+    run = optimizeScenario if optimize else runScenario # optimizing runs the best new product found
+    results = run(progress=progress, cache=None if session is None else samples, **params)
+    if params['seed'] is not None:
+        cache.put(scenarioKey(dict(params, optimize=optimize)), results)
+    return results
 
-    def setAttributes(self):
-        attributes = []
-        for _, row in self.attributeDF.iterrows():
-            attribute = None
-            if not None in row.values:
-                attribute = Attribute(*row.values)
-            print(attribute)
-            attributes.append(attribute)
-        self.attributes = attributes
 
-    def setProducts(self):
-        products = []
-        for col in self.productDF:
-            values = self.productDF[col]
-            products.append(Product(values.values, col))
-        self.products = products
+samples = SampleCache() # sampled preferences of this job worker, a session's jobs are routed to the same worker to reuse them
 
-    def getProfitData(self):
-        return self.profitDF
+jobs = JobQueue() # simulations run as background jobs so web workers stay free
+workers = WorkerPool(runJob)
 
-    def getNonCumulativeProfitData(self):
-        return self.noncumulativeprofitDF
 
-    def getMarketShares(self):
-        ms = {'Product Name': [], 'Sales': []}
-        for product in self.products:
-            ms['Product Name'].append(product.name)
-            ms['Sales'].append(product.sales)
-        df = pd.DataFrame(ms)
-        return df
+@server.route('/metrics')
+def metrics():
+    cacheStats = cache.stats()
+    counters = {'cache_hits_total': cacheStats['hits'], 'cache_misses_total': cacheStats['misses']}
+    gauges = {
+        'start_time_seconds': start_time,
+        'cache_entries': cacheStats['entries'],
+        'cache_bytes': cacheStats['bytes'],
+        'jobs': {f'status="{status}"': count for status, count in jobs.counts().items()},
+    }
+    return flask.Response(registry.render(gauges, counters), mimetype='text/plain; version=0.0.4')
 
 # -------------------------------------------------------
 
@@ -203,7 +82,11 @@ instructions = [
     'Add or remove products and attributes by pressing the associated buttons. Rename products by pressing the pencil icon in the cell\'s header; remove products by pressing the trash icon',
     'Spread, Weight, and all product scores between 0 and 10. Edit the default values in the table to reflect your product',
     'Consumer count and number of months to simulate will determine sales - edit the placeholder values to reflect market conditions. Enter the cost to produce your new product to determine profits',
+    'Simulations run in the background: the bar under the form shows progress and the graphs fill in as the run goes. Cancel stops a run early and keeps the graphs drawn so far',
     'To analyze the graphs, hover over each to determine an exact number of sales or profits',
+    'With a seed entered, rerunning the same table gives the same result and is returned instantly; leave it empty for a fresh random run',
+    'Optimize New Product searches the New Product\'s attribute scores (0 to 10) and price for the highest cumulative profit, then runs and charts the best design it found',
+    'For a quick estimate, enter a number of Agents: that many weighted representative consumers stand in for the whole market, and the pie chart title shows the resulting error in the market shares. Leave it blank to simulate every consumer',
     'If the page fails to load at any point, press the Run Simulation button again; if that fails, refresh the page and reenter the information. To download, visit https://github.com/whitmd/ie-summer',
     ]
 
@@ -364,7 +247,7 @@ app.layout = html.Div([
                             [
                                 dbc.Label("Consumers", className="mr-2"),
                                 dbc.Input(
-                                    id='consumers-in-market', type='number', value=1000, max=5000),
+                                    id='consumers-in-market', type='number', value=1000),
                             ],
                             className="mr-3",
                         ),
@@ -390,13 +273,40 @@ app.layout = html.Div([
                                 dbc.Input(
                                     id='production-cost', placeholder='Enter production cost', type='number'),
                             ],
+                            className="mr-3",
+                        ),
+                        dbc.FormGroup(
+                            [
+                                dbc.Label("Seed", className="mr-2"),
+                                dbc.Input(
+                                    id='seed', placeholder='Random', type='number', style={'width': '100px'}),
+                            ],
+                            className="mr-3",
+                        ),
+                        dbc.FormGroup(
+                            [
+                                dbc.Label("Agents", className="mr-2"),
+                                dbc.Input(
+                                    id='agents', placeholder='All', type='number', min=MIN_AGENTS, style={'width': '100px'}),
+                            ],
                             className="mr-5",
                         ),
                         
                         dbc.Button('Run Simulation',
-                                   id='run-sim', color="success"),
+                                   id='run-sim', color="success", className="mr-2"),
+                        dbc.Button('Optimize New Product',
+                                   id='optimize-sim', color="info", className="mr-2"),
+                        dbc.Button('Cancel',
+                                   id='cancel-sim', color="danger"),
                     ],
                     inline=True, className='my-2'),
+
+                dbc.Progress(id='sim-progress', value=0, striped=True, animated=True, className='mx-3 mb-2'),
+                html.Div(id='design', className='mx-3 mb-2'), # the scores and price picked by Optimize New Product
+                dcc.Store(id='sim-job'),
+                dcc.Store(id='session', storage_type='session'), # lets reruns in this tab reuse the sampled consumers
+                dcc.Store(id='chart-data'), # compact arrays, drawn into the charts by assets/charts.js
+                dcc.Interval(id='sim-poll', interval=500, disabled=True), # polls the background job while it runs
             ]),
 
                 width=12, style={'backgroundColor': 'rgb(45, 101, 115)'}),
@@ -444,37 +354,78 @@ def update_columns(n_clicks, value, existing_columns):
 prevent_initial_call = True
 
 
-@app.callback(
-    Output('pie-chart', 'figure'),
-    Output('line-graph', 'figure'),
-    Output('bar-graph-noncum', 'figure'),
+@app.callback( # submits runs to the background workers, then polls them until the charts are ready
+    Output('chart-data', 'data'),
+    Output('sim-progress', 'value'),
+    Output('sim-progress', 'children'),
+    Output('sim-poll', 'disabled'),
+    Output('sim-job', 'data'),
+    Output('session', 'data'),
+    Output('design', 'children'),
     Input('run-sim', 'n_clicks'),
+    Input('optimize-sim', 'n_clicks'),
+    Input('sim-poll', 'n_intervals'),
+    Input('cancel-sim', 'n_clicks'),
+    State('sim-job', 'data'),
+    State('session', 'data'),
     State('adding-rows-table', 'data'),
     State('adding-rows-table', 'columns'),
     State('consumers-in-market', 'value'),
     State('production-cost', 'value'),
     State('months', 'value'),
-    State('monthsPerTick', 'value'))
+    State('monthsPerTick', 'value'),
+    State('seed', 'value'),
+    State('agents', 'value'))
     
-def generate_chart(n_clicks, table, columns, consumers, cost, months, monthsPerTick):
-    if n_clicks is None:
+def generate_chart(n_clicks, optimize_clicks, n_intervals, cancel_clicks, jobId, session, table, columns, consumers, cost, months, monthsPerTick, seed, agents):
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    unchanged = dash.no_update
+    if n_clicks is None and optimize_clicks is None:
         raise PreventUpdate
-    else:
-        print([c['id'] for c in columns])
-        df = pd.DataFrame.from_records(table, columns=[c['id'] for c in columns])
-        print(df)
-        sim = Simulation(df, consumers, int(months), cost, monthsPerTick)
-
-        ms = sim.getMarketShares()
-        pie = px.pie(ms, values='Sales', names='Product Name',hover_name='Product Name', title='Market Share', color_discrete_sequence=px.colors.qualitative.Prism, ) # pie chart: market share
-
-        profit = sim.getProfitData()
-        line = px.line(profit, x="Time (Months)", y="Profit ($)", title='New Product Cumulative Profit', color_discrete_sequence=px.colors.qualitative.Prism) # line graph: profit
-       
-        noncumulativeprofit = sim.getNonCumulativeProfitData()
-        noncumbar = px.line(noncumulativeprofit, x="Time (Months)", y="Profit ($)", title='New Product Non-Cumulative Profit', color_discrete_sequence=px.colors.qualitative.Prism) # line graph: profit non cumulative
-        
-        return pie, line, noncumbar
+    elif trigger in ('run-sim', 'optimize-sim'):
+        params = {'table': table, 'columns': [c['id'] for c in columns], 'consumers': consumers, 'months': months, 'cost': cost,
+                  'monthsPerTick': monthsPerTick, 'seed': seed, 'agents': agents, 'optimize': trigger == 'optimize-sim'}
+        session = session or uuid.uuid4().hex
+        debug(params['columns'])
+        if jobId is not None: # a new run replaces the previous one, which would otherwise hold a job worker until it finished
+            jobs.cancel(jobId)
+        results = None if seed is None else cache.get(scenarioKey(params)) # unseeded runs are a fresh random draw every time, so never cached
+        jobId = jobs.submit(dict(params, session=session), results, workers.route(session))
+        if results is None:
+            workers.start()
+        return unchanged, 0, '', False, jobId, session, ''
+    elif jobId is None:
+        raise PreventUpdate
+    elif trigger == 'cancel-sim':
+        jobs.cancel(jobId)
+
+    job = jobs.get(jobId)
+    if job['result'] is None:
+        data = unchanged
+    else: # partial results while the job runs
+        with timed('figures'):
+            data = chartData(job['result'])
+    design = unchanged
+    if job['result'] is not None and 'design' in job['result']:
+        design = 'Most profitable New Product found: ' + ', '.join(f'{name} {value:g}' for name, value in job['result']['design'].items())
+        if job['result'].get('priceCapped'):
+            design += ' (the highest price searched, a higher price may be more profitable)'
+    if job['status'] in ('queued', 'running'):
+        percent = int(job['progress'] * 100)
+        return data, percent, f'{percent}%', False, jobId, unchanged, design
+    elif job['status'] == 'done':
+        return data, 100, '', True, jobId, unchanged, design
+    else: # cancelled or failed
+        debug(job['error'])
+        return data, 0, job['status'].capitalize(), True, jobId, unchanged, design
+
+
+app.clientside_callback( # figures are assembled in the browser, so responses carry only the numbers
+    ClientsideFunction(namespace='charts', function_name='figures'),
+    Output('pie-chart', 'figure'),
+    Output('line-graph', 'figure'),
+    Output('bar-graph-noncum', 'figure'),
+    Input('chart-data', 'data'))
 
 
 prevent_initial_call = True
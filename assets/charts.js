@@ -0,0 +1,52 @@
+// builds the three charts from the compact arrays returned by generate_chart (see charts.py)
+var PRISM = ['rgb(95, 70, 144)', 'rgb(29, 105, 150)', 'rgb(56, 166, 165)', 'rgb(15, 133, 84)', 'rgb(115, 175, 72)',
+             'rgb(237, 173, 8)', 'rgb(225, 124, 5)', 'rgb(204, 80, 62)', 'rgb(148, 52, 110)', 'rgb(111, 64, 112)',
+             'rgb(102, 102, 102)'];
+
+function lineFigure(series, title) {
+    return {
+        data: [{
+            type: series.webgl ? 'scattergl' : 'scatter', // WebGL keeps long series responsive
+            mode: 'lines',
+            x: series.x,
+            y: series.y,
+            line: {color: PRISM[0]},
+            hovertemplate: 'Time (Months)=%{x}<br>Profit ($)=%{y}<extra></extra>'
+        }],
+        layout: {
+            title: {text: title},
+            xaxis: {title: {text: 'Time (Months)'}},
+            yaxis: {title: {text: 'Profit ($)'}},
+            legend: {tracegroupgap: 0}
+        }
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    charts: {
+        figures: function(data) {
+            if (!data) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            var pie = {
+                data: [{
+                    type: 'pie',
+                    labels: data.shares.labels,
+                    values: data.shares.values,
+                    marker: {colors: PRISM},
+                    hovertemplate: '<b>%{label}</b><br><br>Product Name=%{label}<br>Sales=%{value}<extra></extra>'
+                }],
+                layout: {title: {text: 'Market Share'}, legend: {tracegroupgap: 0}}
+            };
+            if (data.shares.error) { // representative-agent runs show the largest 95% error of the shares
+                var error = Math.max.apply(null, data.shares.error);
+                pie.layout.title.text = 'Market Share (\u00b1' + (100 * error).toFixed(1) + ' pts)';
+                pie.data[0].customdata = data.shares.error.map(function(e) { return (100 * e).toFixed(1); });
+                pie.data[0].hovertemplate = '<b>%{label}</b><br><br>Product Name=%{label}<br>Sales=%{value}<br>' +
+                                            'Share=%{percent} \u00b1 %{customdata} pts<extra></extra>';
+            }
+            return [pie, lineFigure(data.profit, 'New Product Cumulative Profit'),
+                    lineFigure(data.noncumulativeProfit, 'New Product Non-Cumulative Profit')];
+        }
+    }
+});
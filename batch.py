@@ -0,0 +1,119 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from purchases import LOG_FORMATS
+from shards import SHARD_PROCESSES
+from simulation import runScenario
+
+# headless runner: python batch.py scenarios.json --output results.csv
+#
+# JSON scenario files hold a list of objects with the same fields as the app:
+#   {"name": ..., "table": [rows of the adding-rows-table data], "columns": [...], "consumers": ...,
+#    "months": ..., "monthsPerTick": ..., "cost": ..., "seed": ..., "agents": ...}
+# "columns" defaults to the keys of the first row. CSV scenario files hold the table rows of every
+# scenario, with the scenario settings repeated on each row in the SCENARIO_COLUMNS columns.
+# "agents" is optional: it runs that many weighted representative agents (at least 8) instead of every consumer.
+# "events" is an optional JSON list of market events, see Simulation.schedule:
+#   [{"month": 12, "kind": "price", "product": "Competitor-1", "value": 30}, {"month": 6, "kind": "launch", "product": ...}]
+
+ATTRIBUTE_COLUMNS = ['Attribute', 'Kanotype', 'Direction', 'Weight', 'Spread']
+
+SCENARIO_COLUMNS = {'Scenario': 'name', 'Consumers': 'consumers', 'Months': 'months',
+                    'MonthsPerTick': 'monthsPerTick', 'Cost': 'cost', 'Seed': 'seed', 'Agents': 'agents'}
+
+FORMATS = ['csv', 'parquet']
+
+
+def number(value): # numeric scenario settings read from CSV, empty means unset
+    if value in ('', None):
+        return None
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def readScenarios(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            scenarios = json.load(f)
+        for idx, scenario in enumerate(scenarios):
+            scenario.setdefault('name', f'Scenario {idx + 1}')
+            scenario.setdefault('columns', list(scenario['table'][0]))
+            scenario.setdefault('seed', None)
+            scenario.setdefault('agents', None)
+            scenario.setdefault('events', None)
+        return scenarios
+
+    scenarios = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            name = row.get('Scenario') or 'Scenario 1'
+            if name not in scenarios:
+                scenarios[name] = {key: number(row.get(column)) for column, key in SCENARIO_COLUMNS.items() if column != 'Scenario'}
+                scenarios[name].update(name=name, table=[])
+            scenarios[name]['table'].append({column: value for column, value in row.items() if column not in SCENARIO_COLUMNS})
+
+    for scenario in scenarios.values(): # products missing from a scenario are left blank in its rows
+        products = [column for column in scenario['table'][0] if column not in ATTRIBUTE_COLUMNS
+                    and any(row[column] not in ('', None) for row in scenario['table'])]
+        scenario['columns'] = ATTRIBUTE_COLUMNS + products
+    return list(scenarios.values())
+
+
+def runBatchScenario(scenario, shards=SHARD_PROCESSES, logPath=None): # top level so the process pool can pickle it
+    return runScenario(scenario['table'], scenario['columns'], scenario['consumers'], scenario['months'],
+                       scenario['cost'], scenario['monthsPerTick'], scenario['seed'], agents=scenario['agents'], processes=shards,
+                       events=scenario.get('events'), purchaseLog=logPath)
+
+
+def writeResults(scenarios, results, output, format):
+    import pandas as pd
+    profit, shares = [], []
+    for scenario, result in zip(scenarios, results):
+        df = pd.DataFrame(result['profit'])
+        df['Non-Cumulative Profit ($)'] = result['noncumulativeProfit']['Profit ($)']
+        df.insert(0, 'Scenario', scenario['name'])
+        profit.append(df)
+
+        df = pd.DataFrame(result['marketShares'])
+        df['Market Share'] = df['Sales'] / max(df['Sales'].sum(), 1)
+        if 'shareError' in result:
+            df['Share 95% Error'] = result['shareError']['95% Error']
+        df.insert(0, 'Scenario', scenario['name'])
+        shares.append(df)
+
+    root, ext = os.path.splitext(output)
+    for df, path in ((pd.concat(profit), output), (pd.concat(shares), f'{root}_shares{ext}')):
+        if format == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run ABM market scenarios without the web app.')
+    parser.add_argument('scenarios', help='scenario file, .json or .csv')
+    parser.add_argument('--output', '-o', default='results.csv', help='profit series; market shares go next to it with a _shares suffix')
+    parser.add_argument('--format', choices=FORMATS, help='defaults to the output file extension')
+    parser.add_argument('--processes', type=int, help='worker processes, defaults to one per core')
+    parser.add_argument('--shards', type=int, default=SHARD_PROCESSES, help='processes stepping each scenario, for very large markets; '
+                        'combine with a lower --processes so the cores are not oversubscribed')
+    parser.add_argument('--purchase-log', metavar='DIRECTORY', help='also write every purchase of each scenario to DIRECTORY/<scenario>.<format>')
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='csv', help='purchase log format, parquet and arrow need pyarrow')
+    args = parser.parse_args(args)
+
+    format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    scenarios = readScenarios(args.scenarios)
+    logPaths = [None] * len(scenarios)
+    if args.purchase_log:
+        os.makedirs(args.purchase_log, exist_ok=True)
+        logPaths = [os.path.join(args.purchase_log, f"{scenario['name']}.{args.log_format}") for scenario in scenarios]
+    with ProcessPoolExecutor(args.processes) as pool: # scenarios are independent, so they spread across cores
+        results = list(pool.map(runBatchScenario, scenarios, [args.shards] * len(scenarios), logPaths))
+    writeResults(scenarios, results, args.output, format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import simulation
+from charts import chartData
+from simulation import KANOTYPES, DIRECTIONS, Simulation, getResults
+
+# performance benchmark for the simulation core:
+#   python benchmark.py --save         records benchmark-baseline.json
+#   python benchmark.py                compares against it, exits 1 on a regression
+# each case runs in a fresh process so its peak memory is not hidden by earlier cases
+
+GRID = { # consumers x products x attributes x months x monthsPerTick
+    'consumers': [1000, 10000, 100000],
+    'products': [2, 6],
+    'attributes': [3, 8],
+    'months': [36, 120],
+    'monthsPerTick': [1, 0.25],
+}
+
+QUICK_GRID = {'consumers': [1000, 10000], 'products': [2], 'attributes': [3], 'months': [36], 'monthsPerTick': [1]}
+
+PHASES = ['setup', 'sampling', 'choice', 'bookkeeping', 'figures']
+
+BASELINE_PATH = 'benchmark-baseline.json'
+
+NOISE_FLOOR = 0.01 # seconds, baseline times this short are mostly noise and never count as regressions
+
+
+def makeTable(products, attributes, rng): # app-style table with lifespan and price rows, then random scored attributes
+    import pandas as pd
+    names = ['NewProduct'] + [f'Competitor-{idx}' for idx in range(1, products)]
+    rows = [['Lifespan (months)', 'satisfier', 'higher is better', 5, 5] + list(rng.integers(3, 24, products)),
+            ['Price', 'satisfier', 'lower is better', 5, 5] + list(rng.integers(10, 100, products))]
+    for idx in range(attributes - 2):
+        rows.append([f'Attribute {idx + 1}', rng.choice(KANOTYPES), rng.choice(DIRECTIONS), rng.integers(1, 10), rng.integers(1, 10)]
+                    + list(rng.uniform(0, 10, products).round(1)))
+    return pd.DataFrame(rows, columns=['Attribute', 'Kanotype', 'Direction', 'Weight', 'Spread'] + names)
+
+
+class Timer: # wraps a function and accumulates the time spent in it
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def runCase(case, figures=True, processes=1):
+    table = makeTable(case['products'], case['attributes'], np.random.default_rng(0))
+    startRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sample = simulation.samplePreferences = Timer(simulation.samplePreferences) # Population.sample calls it once per chunk
+    times = {}
+
+    with redirect_stdout(io.StringIO()): # Simulation prints its attributes
+        start = time.perf_counter()
+        sim = Simulation(table, case['consumers'], case['months'], 5, case['monthsPerTick'], seed=0, run=False, processes=processes)
+        times['sampling'] = sample.seconds
+        times['setup'] = time.perf_counter() - start - sample.seconds
+
+        step = sim.engine.step = Timer(sim.engine.step)
+        start = time.perf_counter()
+        sim.run()
+        times['choice'] = step.seconds
+        times['bookkeeping'] = time.perf_counter() - start - step.seconds
+
+    if figures: # the chart payload generate_chart builds, the figures themselves are drawn in the browser
+        start = time.perf_counter()
+        json.dumps(chartData(getResults(sim)))
+        times['figures'] = time.perf_counter() - start
+
+    consumerTicks = case['consumers'] * sim.ticks
+    return {
+        'times': times,
+        'total': sum(times.values()),
+        'consumerTicksPerSecond': consumerTicks / max(times['choice'] + times['bookkeeping'], 1e-9),
+        'peakMemoryMB': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - startRss) / 1024, # ru_maxrss is in KiB on Linux
+    }
+
+
+def caseName(case):
+    return 'c{consumers}-p{products}-a{attributes}-m{months}-t{monthsPerTick}'.format(**case)
+
+
+def runGrid(grid, repeat, figures, processes=1):
+    context = multiprocessing.get_context('spawn') # fresh interpreter per case, so peak memory is per case
+    results = {}
+    for values in itertools.product(*grid.values()):
+        case = dict(zip(grid, values))
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(1, mp_context=context) as pool: # not daemonic, so a case can start shard processes
+                runs.append(pool.submit(runCase, case, figures, processes).result())
+        best = min(runs, key=lambda run: run['total']) # the fastest repeat is the least disturbed by noise
+        best['peakMemoryMB'] = max(run['peakMemoryMB'] for run in runs)
+        results[caseName(case)] = best
+        print(f"{caseName(case):40} {best['total']:8.3f}s {best['consumerTicksPerSecond']:14,.0f} consumer-ticks/s "
+              f"{best['peakMemoryMB']:8.1f} MB  " + ' '.join(f"{phase}={best['times'][phase]:.3f}" for phase in PHASES if phase in best['times']))
+    return results
+
+
+def compare(results, baseline, threshold, memoryThreshold): # regressions are cases slower or bigger than the baseline by more than the thresholds
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if before['total'] > NOISE_FLOOR and result['total'] > before['total'] * (1 + threshold):
+            regressions.append(f"{name}: {before['total']:.3f}s -> {result['total']:.3f}s")
+        for phase, seconds in result['times'].items():
+            previous = before['times'].get(phase)
+            if previous is not None and previous > NOISE_FLOOR and seconds > previous * (1 + threshold):
+                regressions.append(f"{name} {phase}: {previous:.3f}s -> {seconds:.3f}s")
+        if result['peakMemoryMB'] > max(before['peakMemoryMB'], 1) * (1 + memoryThreshold):
+            regressions.append(f"{name} memory: {before['peakMemoryMB']:.1f} MB -> {result['peakMemoryMB']:.1f} MB")
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation core over a grid of market sizes.')
+    parser.add_argument('--quick', action='store_true', help='small grid for a fast check')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the fastest is kept')
+    parser.add_argument('--no-figures', action='store_true', help='skip building the chart payload')
+    parser.add_argument('--processes', type=int, default=1, help='shard processes per simulation, to measure multi-core scaling')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, as a fraction of the baseline time')
+    parser.add_argument('--memory-threshold', type=float, default=0.25, help='allowed growth of peak memory')
+    args = parser.parse_args(args)
+
+    results = runGrid(QUICK_GRID if args.quick else GRID, args.repeat, not args.no_figures, args.processes)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f'no baseline at {args.baseline}, run with --save to record one')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
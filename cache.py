@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+# default location and size of the result cache, shared by every gunicorn worker on the host
+CACHE_PATH = os.environ.get('ABMS_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'abms-cache.sqlite3'))
+CACHE_MAX_BYTES = int(os.environ.get('ABMS_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+class ResultCache: # content-addressed, size-bounded LRU cache of simulation results stored in SQLite
+    def __init__(self, path=CACHE_PATH, maxBytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.ready = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.ready: # tables are created on first use so importing the app never touches the disk
+            connection.execute('PRAGMA journal_mode=WAL') # lets workers read while another one writes
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            connection.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+            connection.commit()
+            self.ready = True
+        return connection
+
+    @staticmethod
+    def key(*parts): # canonical hash of the scenario, independent of dict ordering
+        canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key):
+        connection = self.connect()
+        try:
+            with connection:
+                row = connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                counter = 'misses' if row is None else 'hits'
+                connection.execute('UPDATE counters SET value = value + 1 WHERE name = ?', (counter,))
+                if row is None:
+                    return None
+                connection.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+            return json.loads(zlib.decompress(row[0]))
+        finally:
+            connection.close()
+
+    def put(self, key, value):
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+                self.evict(connection)
+        finally:
+            connection.close()
+
+    def evict(self, connection): # drops least recently used results until the cache fits in maxBytes
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY used').fetchall():
+            if total <= self.maxBytes:
+                break
+            connection.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+
+    def stats(self):
+        connection = self.connect()
+        try:
+            stats = dict(connection.execute('SELECT name, value FROM counters').fetchall())
+            stats['entries'], stats['bytes'] = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            return stats
+        finally:
+            connection.close()
+
+    def clear(self):
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM results')
+                connection.execute('UPDATE counters SET value = 0')
+        finally:
+            connection.close()
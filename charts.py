@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+# compact chart payloads: the server sends downsampled numeric arrays and assets/charts.js builds the figures in the browser
+
+MAX_POINTS = int(os.environ.get('ABMS_MAX_POINTS', 1000)) # points sent per line chart
+
+WEBGL_POINTS = 500 # line charts with more points than this are drawn with WebGL
+
+
+def lttb(x, y, threshold): # largest-triangle-three-buckets downsampling, keeps peaks and the overall shape of the series
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if threshold >= len(x) or threshold < 3:
+        return x, y
+
+    every = (len(x) - 2) / (threshold - 2) # the first and last points are always kept, the rest is split into buckets
+    keep = np.zeros(threshold, dtype=int)
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        nextEnd = min(int((i + 2) * every) + 1, len(x))
+        nextX, nextY = x[end:nextEnd].mean(), y[end:nextEnd].mean() # third corner is the average of the next bucket
+
+        area = np.abs((x[a] - nextX) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (nextY - y[a]))
+        a = start + int(area.argmax()) # the point making the largest triangle with the previous pick
+        keep[i + 1] = a
+    keep[-1] = len(x) - 1
+    return x[keep], y[keep]
+
+
+def compact(values, digits=2): # rounded plain floats, so the JSON stays short
+    return [round(value, digits) for value in np.asarray(values, dtype=float).tolist()]
+
+
+def chartData(results, maxPoints=MAX_POINTS): # what the browser needs to draw the three charts from runScenario results
+    data = {'shares': {'labels': results['marketShares']['Product Name'], 'values': compact(results['marketShares']['Sales'])}}
+    for name, series in (('profit', results['profit']), ('noncumulativeProfit', results['noncumulativeProfit'])):
+        x, y = lttb(series['Time (Months)'], series['Profit ($)'], maxPoints)
+        data[name] = {'x': compact(x, 4), 'y': compact(y), 'webgl': len(x) > WEBGL_POINTS, 'points': len(series['Profit ($)'])}
+    if 'shareError' in results: # representative-agent runs, the 95% error of each share
+        data['shares']['error'] = compact(results['shareError']['95% Error'], 4)
+    return data
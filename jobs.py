@@ -0,0 +1,180 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+import zlib
+
+try:
+    import fcntl
+except ImportError: # not available on Windows, where every web worker starts its own pool
+    fcntl = None
+
+# job database and worker pool size, shared by every gunicorn worker on the host
+JOBS_PATH = os.environ.get('ABMS_JOBS_PATH', os.path.join(tempfile.gettempdir(), 'abms-jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('ABMS_JOB_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+HEARTBEAT_INTERVAL = 5 # seconds between a running job's heartbeats
+
+STALE_AFTER = 60 # seconds without a heartbeat before a running job's worker is taken for dead
+
+ROUTE_WAIT = 1 # seconds a job waits for the worker it was routed to before any worker may take it
+
+
+class JobCancelled(Exception): # raised inside a running job once it has been cancelled
+    pass
+
+
+class JobQueue: # SQLite-backed job queue, so no external broker is needed
+    def __init__(self, path=JOBS_PATH):
+        self.path = path
+        self.ready = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None) # transactions are opened explicitly
+        if not self.ready:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, progress REAL, '
+                               'params TEXT, result TEXT, error TEXT, created REAL, updated REAL, worker INTEGER)')
+            if 'worker' not in [column[1] for column in connection.execute('PRAGMA table_info(jobs)')]: # database of an older version
+                connection.execute('ALTER TABLE jobs ADD COLUMN worker INTEGER')
+            self.ready = True
+        return connection
+
+    def execute(self, sql, args=()):
+        connection = self.connect()
+        try:
+            return connection.execute(sql, args).fetchall()
+        finally:
+            connection.close()
+
+    def submit(self, params, result=None, worker=None): # a result marks the job as already done, e.g. when it came from the cache
+        jobId = uuid.uuid4().hex # a worker index routes the job to that worker, e.g. the one holding its session's samples
+        status, progress = ('queued', 0) if result is None else ('done', 1)
+        now = time.time()
+        self.execute('INSERT INTO jobs (id, status, progress, params, result, created, updated, worker) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (jobId, status, progress, json.dumps(params), json.dumps(result), now, now, worker))
+        self.prune()
+        return jobId
+
+    def claim(self, worker=None): # atomically moves the oldest queued job this worker may run to running
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute("UPDATE jobs SET status = 'failed', error = 'the worker running this job stopped', updated = ? "
+                               "WHERE status = 'running' AND updated < ?", (time.time(), time.time() - STALE_AFTER)) # its worker died mid-job
+            row = connection.execute("SELECT id, params FROM jobs WHERE status = 'queued' AND (worker IS NULL OR worker = ? OR created < ?) "
+                                     "ORDER BY created LIMIT 1", (worker, time.time() - ROUTE_WAIT)).fetchone() # routed jobs fall back to any free worker
+            if row is not None:
+                connection.execute("UPDATE jobs SET status = 'running', updated = ? WHERE id = ?", (time.time(), row[0]))
+            connection.execute('COMMIT')
+            return None if row is None else (row[0], json.loads(row[1]))
+        finally:
+            connection.close()
+
+    def get(self, jobId):
+        rows = self.execute('SELECT status, progress, result, error FROM jobs WHERE id = ?', (jobId,))
+        if not rows:
+            return None
+        status, progress, result, error = rows[0]
+        return {'status': status, 'progress': progress, 'result': json.loads(result), 'error': error}
+
+    def setProgress(self, jobId, progress, partial=None): # returns the job status so a running job notices cancellation
+        if partial is None:
+            self.execute("UPDATE jobs SET progress = ?, updated = ? WHERE id = ? AND status = 'running'", (progress, time.time(), jobId))
+        else: # partial results are shown while the job runs, and kept if it is cancelled
+            self.execute("UPDATE jobs SET progress = ?, result = ?, updated = ? WHERE id = ? AND status = 'running'",
+                         (progress, json.dumps(partial), time.time(), jobId))
+        return self.execute('SELECT status FROM jobs WHERE id = ?', (jobId,))[0][0]
+
+    def heartbeat(self, jobId): # a running job's worker is still alive, even between progress reports
+        self.execute("UPDATE jobs SET updated = ? WHERE id = ? AND status = 'running'", (time.time(), jobId))
+
+    def finish(self, jobId, result):
+        self.execute("UPDATE jobs SET status = 'done', progress = 1, result = ?, updated = ? WHERE id = ? AND status = 'running'",
+                     (json.dumps(result), time.time(), jobId))
+
+    def fail(self, jobId, error):
+        self.execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ?", (error, time.time(), jobId))
+
+    def cancel(self, jobId):
+        self.execute("UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ? AND status IN ('queued', 'running')", (time.time(), jobId))
+
+    def counts(self): # number of jobs in each status
+        return dict(self.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+
+    def prune(self, maxAge=24 * 60 * 60): # forgets finished jobs nobody is polling anymore
+        self.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated < ?", (time.time() - maxAge,))
+
+
+def workerLoop(path, handler, worker=None, poll=0.2, progressInterval=0.25):
+    queue = JobQueue(path)
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(poll)
+            continue
+        jobId, params = job
+        lastUpdate = [0]
+
+        def progress(fraction, partial=None): # throttled, so reporting progress stays cheap inside the tick loop
+            now = time.time()
+            if now - lastUpdate[0] >= progressInterval or fraction >= 1:
+                lastUpdate[0] = now
+                if queue.setProgress(jobId, fraction, partial) == 'cancelled':
+                    raise JobCancelled()
+
+        stopped = threading.Event()
+
+        def beat(): # keeps `updated` fresh through long stretches without progress reports
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                queue.heartbeat(jobId)
+
+        heart = threading.Thread(target=beat, daemon=True)
+        heart.start()
+        try:
+            result = handler(params, progress)
+        except JobCancelled:
+            continue
+        except Exception:
+            queue.fail(jobId, traceback.format_exc())
+        else:
+            queue.finish(jobId, result)
+        finally:
+            stopped.set()
+            heart.join()
+
+
+class WorkerPool: # local processes running queued jobs, started once per host on first use
+    def __init__(self, handler, path=JOBS_PATH, processes=JOB_WORKERS):
+        self.handler = handler # handler(params, progress) returns a JSON-serializable result, progress(fraction, partial=None)
+        self.path = path
+        self.processes = processes
+        self.lock = None
+        self.workers = []
+
+    def route(self, key): # the same worker for the same key in every web worker, unlike hash()
+        return zlib.crc32(key.encode()) % self.processes
+
+    def start(self): # called on every submit, so another web worker takes over the pool if its owner exits
+        if self.workers:
+            for index, worker in enumerate(self.workers): # replaces workers that died, their jobs fail once their heartbeat is stale
+                if not worker.is_alive():
+                    self.workers[index] = multiprocessing.Process(target=workerLoop, args=(self.path, self.handler, index), daemon=True)
+                    self.workers[index].start()
+            return
+        if fcntl is not None: # only the web worker holding the lock runs the pool, the others just submit
+            if self.lock is None:
+                self.lock = open(self.path + '.lock', 'w')
+            try:
+                fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+        self.workers = [multiprocessing.Process(target=workerLoop, args=(self.path, self.handler, index), daemon=True)
+                        for index in range(self.processes)]
+        for worker in self.workers:
+            worker.start()
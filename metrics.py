@@ -0,0 +1,90 @@
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+# profiling hooks for the simulation and the app, and a Prometheus-text registry shared by every process on the host
+
+DEBUG = os.environ.get('ABMS_DEBUG', '1') != '0' # ABMS_DEBUG=0 turns off the debug printing, which is slow under load
+
+METRICS_PATH = os.environ.get('ABMS_METRICS_PATH', os.path.join(tempfile.gettempdir(), 'abms-metrics.sqlite3'))
+
+hooks = [] # hook(phase, seconds, info) is called after every timed phase
+
+
+def debug(*args):
+    if DEBUG:
+        print(*args)
+
+
+def addHook(hook):
+    hooks.append(hook)
+
+
+def removeHook(hook):
+    hooks.remove(hook)
+
+
+def record(phase, seconds, **info):
+    for hook in hooks:
+        hook(phase, seconds, info)
+
+
+@contextmanager
+def timed(phase, **info): # times the block and reports it to every hook
+    start = time.perf_counter()
+    try:
+        yield info # the block can add details, e.g. the size of the run
+    finally:
+        record(phase, time.perf_counter() - start, **info)
+
+
+class Registry: # phase timings and run sizes, stored in SQLite because simulations run in the job worker processes
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self.ready = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.ready:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS metrics (name TEXT, phase TEXT, count INTEGER, total REAL, PRIMARY KEY (name, phase))')
+            self.ready = True
+        return connection
+
+    def observe(self, phase, seconds, info): # a hook, see addHook
+        values = [('phase_seconds', phase, seconds)] + [('run_' + re.sub('([A-Z])', r'_\1', name).lower(), phase, value)
+                                                          for name, value in info.items() if isinstance(value, (int, float))]
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany('INSERT INTO metrics VALUES (?, ?, 1, ?) ON CONFLICT (name, phase) '
+                                       'DO UPDATE SET count = count + 1, total = total + excluded.total', values)
+        finally:
+            connection.close()
+
+    def render(self, gauges=None, counters=None): # Prometheus text exposition format
+        connection = self.connect()
+        try:
+            rows = connection.execute('SELECT name, phase, count, total FROM metrics ORDER BY name, phase').fetchall()
+        finally:
+            connection.close()
+
+        lines = []
+        for name in sorted(set(row[0] for row in rows)):
+            lines.append(f'# TYPE abms_{name} summary')
+            for _, phase, count, total in (row for row in rows if row[0] == name):
+                lines.append(f'abms_{name}_sum{{phase="{phase}"}} {total}')
+                lines.append(f'abms_{name}_count{{phase="{phase}"}} {count}')
+        for name, value in (counters or {}).items():
+            lines.append(f'# TYPE abms_{name} counter')
+            lines.append(f'abms_{name} {value}')
+        for name, value in (gauges or {}).items():
+            lines.append(f'# TYPE abms_{name} gauge')
+            if isinstance(value, dict): # labelled values, e.g. jobs by status
+                lines.extend(f'abms_{name}{{{label}}} {v}' for label, v in value.items())
+            else:
+                lines.append(f'abms_{name} {value}')
+        return '\n'.join(lines) + '\n'
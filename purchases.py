@@ -0,0 +1,105 @@
+import csv
+import os
+
+import numpy as np
+
+# purchase event log: one record per purchase, written in fixed-size batches so memory stays flat however long the run
+
+LOG_FORMATS = ['csv', 'parquet', 'arrow']
+
+LOG_BATCH = int(os.environ.get('ABMS_LOG_BATCH', 1 << 16)) # records buffered before each write
+
+LOG_COLUMNS = ['Tick', 'Consumer', 'Product', 'Margin', 'Weight'] # margin is the chosen product's utility over the runner-up,
+# weight the consumers a stratified agent's purchase stands for, 1 otherwise
+
+
+class PurchaseLog:
+    def __init__(self, path, format=None, batchSize=LOG_BATCH, productNames=None):
+        format = format or os.path.splitext(path)[1].lstrip('.').replace('feather', 'arrow') or 'csv'
+        if format not in LOG_FORMATS:
+            raise ValueError(f"format must be one of {LOG_FORMATS}, got {format!r}")
+        self.path = path
+        self.format = format
+        self.productNames = [] if productNames is None else list(productNames)
+        self.ticks = np.zeros(batchSize, np.int32)
+        self.consumers = np.zeros(batchSize, np.int64)
+        self.products = np.zeros(batchSize, np.int32)
+        self.margins = np.zeros(batchSize)
+        self.weights = np.zeros(batchSize)
+        self.size = 0 # records in the buffers
+        self.records = 0 # records written so far
+        self.writer = None
+        self.file = None
+        self.schema = None
+        self.closed = False
+
+    def write(self, tick, consumers, products, margins, weights=1):
+        done = 0
+        while done < len(consumers): # inputs larger than the buffer are split across batches
+            count = min(len(self.ticks) - self.size, len(consumers) - done)
+            window = slice(self.size, self.size + count)
+            self.ticks[window] = tick
+            self.consumers[window] = consumers[done:done + count]
+            self.products[window] = products[done:done + count]
+            self.margins[window] = margins[done:done + count]
+            self.weights[window] = weights if np.isscalar(weights) else weights[done:done + count]
+            self.size += count
+            done += count
+            if self.size == len(self.ticks):
+                self.flush()
+
+    def open(self):
+        if self.format == 'csv':
+            self.file = open(self.path, 'w', newline='')
+            csv.writer(self.file).writerow(LOG_COLUMNS)
+            return
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(f"{self.format} purchase logs need pyarrow, use the csv format without it") from None
+        metadata = {'products': ','.join(self.productNames)} # product ids index this list
+        self.schema = pa.schema([('Tick', pa.int32()), ('Consumer', pa.int64()), ('Product', pa.int32()), ('Margin', pa.float64()),
+                                 ('Weight', pa.float64())], metadata)
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            self.file = pa.OSFile(self.path, 'wb')
+            self.writer = pa.ipc.new_file(self.file, self.schema)
+
+    def flush(self): # one CSV block, parquet row group or arrow record batch
+        if self.file is None and self.writer is None:
+            self.open()
+        size = self.size
+        if size:
+            if self.format == 'csv':
+                np.savetxt(self.file, np.column_stack([self.ticks[:size], self.consumers[:size], self.products[:size], self.margins[:size],
+                                                       self.weights[:size]]), fmt=['%d', '%d', '%d', '%.6g', '%.17g'], delimiter=',')
+            else:
+                import pyarrow as pa
+                batch = pa.record_batch([self.ticks[:size], self.consumers[:size], self.products[:size], self.margins[:size], self.weights[:size]],
+                                        schema=self.schema)
+                if self.format == 'parquet':
+                    self.writer.write_table(pa.Table.from_batches([batch]))
+                else:
+                    self.writer.write_batch(batch)
+        self.records += size
+        self.size = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
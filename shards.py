@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# multi-core runs of one simulation: consumers are split into contiguous shards stepped by worker processes,
+# with the population and the per-tick counters in shared memory so nothing is pickled per tick
+
+SHARD_PROCESSES = int(os.environ.get('ABMS_SHARD_PROCESSES', 1)) # worker processes per simulation, 1 runs in process
+
+MIN_SHARD = 100000 # consumers per shard below which the tick synchronization costs more than it saves
+
+SINGLE_THREADED = {'OMP_NUM_THREADS': '1', 'OPENBLAS_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'} # one core per shard, not one BLAS pool each
+
+
+class SharedArray(np.ndarray): # keeps its shared memory block open while any view of it is alive
+    pass
+
+
+def sharedArray(shape, dtype): # zeroed array in a new shared memory block, unlinked once the array is garbage collected
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    array = np.ndarray(shape, dtype, block.buf).view(SharedArray)
+    array.block = block
+    array[...] = 0
+    weakref.finalize(array, block.unlink)
+    return array
+
+
+def describe(array): # how a worker process finds the same memory
+    if isinstance(array, np.memmap): # populations with a populationPath are shared through their files
+        return ('file', array.filename)
+    return ('shared', array.block.name, array.shape, array.dtype.str)
+
+
+def attach(description):
+    if description[0] == 'file':
+        return np.lib.format.open_memmap(description[1], 'r+')
+    _, name, shape, dtype = description
+    block = shared_memory.SharedMemory(name) # spawned workers share the parent's resource tracker, which unlinks it if the parent dies
+    array = np.ndarray(shape, dtype, block.buf).view(SharedArray)
+    array.block = block
+    return array
+
+
+def shardWorker(shard, start, stop, arrays, transform, lifespans, monthsPerTick, chunkSize, barrier):
+    arrays = {name: attach(description) for name, description in arrays.items()}
+    preferences, remaining, bestProducer = arrays['preferences'], arrays['remaining'], arrays['bestProducer']
+    command, counts, draws, sales = arrays['command'], arrays['counts'], arrays['draws'], arrays['sales']
+    try:
+        while True:
+            barrier.wait() # the parent set the command
+            if command[0] == 0:
+                return
+            owners = remaining[start:stop] > 0
+            remaining[start:stop][owners] -= monthsPerTick
+            buyers = start + np.flatnonzero(~owners)
+            counts[shard] = len(buyers)
+            barrier.wait() # every shard counted its buyers
+            barrier.wait() # the parent drew the lifespans of all buyers, in consumer order
+            offset = int(counts[:shard].sum())
+            tickSales = np.zeros(len(lifespans), dtype=sales.dtype)
+            for first in range(0, len(buyers), chunkSize):
+                chunk = buyers[first:first + chunkSize]
+                chosen = (preferences[chunk] @ transform).argmax(axis=1)
+                remaining[chunk] = lifespans[chosen] - draws[offset + first:offset + first + len(chunk)]
+                bestProducer[chunk] = chosen
+                tickSales += np.bincount(chosen, minlength=len(lifespans))
+            sales[shard] = tickSales
+            barrier.wait() # sales are ready to be reduced
+    except threading.BrokenBarrierError:
+        return
+    except BaseException:
+        barrier.abort() # the parent raises instead of waiting forever
+        raise
+
+
+class ShardedEngine: # ChoiceEngine.step split across worker processes, with the same random draws and results
+    def __init__(self, population, transform, lifespans, monthsPerTick, rng, chunkSize, processes):
+        self.population = population
+        self.transform = transform
+        self.lifespans = lifespans
+        self.monthsPerTick = monthsPerTick
+        self.rng = rng
+        self.chunkSize = chunkSize
+        self.bounds = np.linspace(0, population.consumers, processes + 1).astype(int) # contiguous consumer ranges
+        self.command = sharedArray((1,), np.int8) # 1 steps every shard, 0 stops the workers
+        self.counts = sharedArray((processes,), np.int64) # buyers in each shard this tick
+        self.draws = sharedArray((population.consumers,), np.float64) # lifespan draws of this tick's buyers
+        self.sales = sharedArray((processes, len(lifespans)), np.int64) # sales per shard and product this tick
+        self.workers = []
+        self.barrier = None
+
+    def start(self):
+        context = multiprocessing.get_context('spawn') # forking a web or job worker that holds threads and connections is unsafe
+        self.barrier = context.Barrier(len(self.bounds))
+        arrays = {'preferences': describe(self.population.preferences), 'remaining': describe(self.population.ownedProductRemainingLifespan),
+                  'bestProducer': describe(self.population.bestProducer), 'command': describe(self.command),
+                  'counts': describe(self.counts), 'draws': describe(self.draws), 'sales': describe(self.sales)}
+        environ = dict(os.environ)
+        os.environ.update(SINGLE_THREADED) # read by numpy as the spawned workers import it
+        try:
+            self.workers = [context.Process(target=shardWorker, daemon=True,
+                                            args=(shard, start, stop, arrays, self.transform, self.lifespans,
+                                                  self.monthsPerTick, self.chunkSize, self.barrier))
+                            for shard, (start, stop) in enumerate(zip(self.bounds[:-1].tolist(), self.bounds[1:].tolist()))]
+            for worker in self.workers:
+                worker.start()
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def wait(self):
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            self.close()
+            raise RuntimeError('a simulation shard worker failed') from None
+
+    def step(self): # advances every consumer one tick, returns sales per product
+        if not self.workers:
+            self.start()
+        self.command[0] = 1
+        self.wait() # shards decrement lifespans and count their buyers
+        self.wait()
+        buyers = int(self.counts.sum())
+        self.draws[:buyers] = self.rng.exponential(size=buyers) # one stream in consumer order, as ChoiceEngine draws it chunk by chunk
+        self.wait() # shards choose and record their purchases
+        self.wait()
+        return self.sales.sum(axis=0)
+
+    def events(self, ticks): # every tick is stepped, the shards already skip consumers who own a product
+        for _ in range(ticks):
+            yield self.step()
+
+    def close(self): # stops the workers, the engine can still be stepped again later
+        if not self.workers:
+            return
+        if not self.barrier.broken:
+            self.command[0] = 0
+            self.barrier.wait()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
@@ -0,0 +1,853 @@
+import math
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from statistics import NormalDist
+import numpy as np
+from metrics import debug, record, timed
+from purchases import PurchaseLog
+from shards import MIN_SHARD, SHARD_PROCESSES, ShardedEngine, sharedArray
+from concurrent.futures import ProcessPoolExecutor
+
+# simulation core, kept free of dash/plotly and importing pandas only when a table is built,
+# so batch workers can import it cheaply
+
+KANOTYPES = ['basic', 'satisfier', 'delighter'] # kano types
+
+DIRECTIONS = ["higher is better", "lower is better"] # indicates reversed kano types
+
+SCHEDULERS = ['tick', 'event'] # poll every consumer each tick, or only process purchase events
+
+CHUNK_SIZE = 1 << 20 # consumers processed at once, bounds the memory used by temporary arrays
+
+SAMPLINGS = ['random', 'stratified'] # one agent per consumer, or a few weighted representative agents
+
+AGENTS = 512 # representative agents in stratified sampling
+
+MARKET_EVENTS = ['price', 'change', 'launch', 'withdraw'] # scheduled mid-run changes to a product
+
+REPLICATES = 8 # independent stratified samples the agents are split into, their spread gives the error estimate
+
+MIN_REPLICATES = 4 # fewest replicates for an error estimate, 3 degrees of freedom
+
+MIN_AGENTS = 2 * MIN_REPLICATES # every replicate needs two agents
+
+T_QUANTILES = {3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365} # exact 97.5% Student t quantiles, by degrees of freedom
+
+SAMPLE_CACHE_BYTES = int(os.environ.get('ABMS_SAMPLE_CACHE_BYTES', 256 << 20)) # preferences and utilities kept per process, e.g. per job worker
+
+SAMPLE_CACHE_COLUMNS = 64 # utility columns kept per sample, older product edits are recomputed
+
+
+def kanoTransform(attributes, kanotype, direction): # kano type formulas, utility per unit of preference
+    attributes = np.asarray(attributes, dtype=float)
+
+    if direction == "lower is better":
+
+        if kanotype == 'basic': # reversed kano types
+            return 0 - math.e ** (2 * attributes - 1)
+        elif kanotype == 'satisfier':
+            return -attributes
+        elif kanotype == 'delighter':
+            return math.e ** (-2 * attributes - 1)
+    else: # normal kano types
+        if kanotype == 'basic':
+            return 0 - math.e ** (-2 * attributes - 1)
+        elif kanotype == 'satisfier':
+            return attributes
+        elif kanotype == 'delighter':
+            return math.e ** (2 * attributes - 1)
+
+    return np.zeros_like(attributes)
+
+
+def samplePreferences(stdevs, weights, consumers, rng=np.random): # consumers x attributes matrix, one lognormal draw per consumer and attribute in row order
+    stdevs = np.asarray(stdevs.values, dtype=float)
+    weights = np.asarray(weights.values, dtype=float)
+    return rng.lognormal(sigma=stdevs, mean=1, size=(consumers, len(stdevs))) * weights
+
+
+def stratifiedPreferences(stdevs, weights, agents, rng=np.random): # latin hypercube draws of the same lognormal preferences
+    stdevs = np.asarray(stdevs.values, dtype=float)
+    weights = np.asarray(weights.values, dtype=float)
+    strata = np.array([rng.permutation(agents) for _ in stdevs]).T # every attribute gets one draw from each of `agents` equal-probability strata
+    quantiles = np.clip((strata + rng.random((agents, len(stdevs)))) / agents, 1e-12, 1 - 1e-12)
+    normal = np.vectorize(NormalDist().inv_cdf)(quantiles)
+    return np.exp(1 + stdevs * normal) * weights
+
+
+def transformMatrix(productDF, kanotypes, directions): # attributes x products, utility = preferences @ transform
+    values = np.asarray(productDF.values, dtype=float)
+    return np.array([kanoTransform(row, kanotype, direction)
+                     for row, kanotype, direction in zip(values, kanotypes.values, directions.values)]).reshape(values.shape)
+
+
+def unitProfit(price, cost): # new product profit per sale, prices count in whole dollars
+    return int(price) - cost
+
+
+class Population: # struct-of-arrays consumer store, optionally memory-mapped so it can be larger than RAM
+    def __init__(self, consumers, attributes, dtype=np.float64, path=None, shared=False, preferences=None):
+        self.consumers = consumers
+        self.weights = None # consumers each agent stands for, set by sampleStratified
+        self.groups = None # replicate each agent was sampled in
+        if preferences is not None: # already sampled, e.g. by an earlier run in the same session
+            self.preferences = preferences
+            self.ownedProductRemainingLifespan = np.zeros(consumers, dtype)
+            self.bestProducer = np.zeros(consumers, np.int32)
+        elif path is None and shared: # in shared memory, so ShardedEngine workers can step it in place
+            self.preferences = sharedArray((consumers, attributes), dtype)
+            self.ownedProductRemainingLifespan = sharedArray(consumers, dtype)
+            self.bestProducer = sharedArray(consumers, np.int32)
+        elif path is None:
+            self.preferences = np.empty((consumers, attributes), dtype) # consumers x attributes
+            self.ownedProductRemainingLifespan = np.zeros(consumers, dtype)
+            self.bestProducer = np.zeros(consumers, np.int32)
+        else: # .npy files in path, paged in and out by the OS as chunks are processed
+            os.makedirs(path, exist_ok=True)
+            self.preferences = np.lib.format.open_memmap(os.path.join(path, 'preferences.npy'), 'w+', dtype, (consumers, attributes))
+            self.ownedProductRemainingLifespan = np.lib.format.open_memmap(os.path.join(path, 'remaining.npy'), 'w+', dtype, (consumers,))
+            self.bestProducer = np.lib.format.open_memmap(os.path.join(path, 'best.npy'), 'w+', np.int32, (consumers,))
+
+    def chunks(self, chunkSize): # fixed-size consumer ranges, so temporary arrays never scale with the population
+        return [slice(start, min(start + chunkSize, self.consumers)) for start in range(0, self.consumers, chunkSize)]
+
+    def sample(self, stdevs, weights, rng, chunkSize): # chunks are drawn in order, so the result matches one samplePreferences call
+        for chunk in self.chunks(chunkSize):
+            self.preferences[chunk] = samplePreferences(stdevs, weights, chunk.stop - chunk.start, rng)
+
+    def sampleStratified(self, stdevs, weights, rng, replicates, market): # agents split into replicates, each an independent stratified sample
+        groups = np.array_split(np.arange(self.consumers), replicates)
+        for group in groups:
+            self.preferences[group] = stratifiedPreferences(stdevs, weights, len(group), rng)
+        self.weights = np.full(self.consumers, market / self.consumers)
+        self.groups = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+
+
+class SampleCache: # sampled preferences and per-product utility columns, so an edited table only recomputes what changed
+    def __init__(self, maxBytes=SAMPLE_CACHE_BYTES, maxColumns=SAMPLE_CACHE_COLUMNS):
+        self.maxBytes = maxBytes
+        self.maxColumns = maxColumns
+        self.samples = OrderedDict() # sample key -> {'preferences', 'state', 'columns'}, least recently used first
+
+    @staticmethod
+    def key(seed, consumers, dtype, spreads, weights): # everything the preference draws depend on
+        return (seed, consumers, np.dtype(dtype).str, tuple(np.asarray(spreads, dtype=float).tolist()),
+                tuple(np.asarray(weights, dtype=float).tolist()))
+
+    def get(self, key): # preferences and the generator state right after drawing them, or None
+        sample = self.samples.get(key)
+        if sample is not None:
+            self.samples.move_to_end(key)
+        return sample
+
+    def put(self, key, preferences, state): # returns the cached sample, or None if it is too large to keep
+        if preferences.nbytes > self.maxBytes:
+            return None
+        self.samples[key] = {'preferences': preferences, 'state': state, 'columns': OrderedDict()}
+        self.evict()
+        return self.samples.get(key)
+
+    def utilities(self, sample, transform): # consumers x products, each column is computed once per transform column
+        columns = []
+        for column in transform.T:
+            columnKey = column.tobytes() # the transform column captures the product scores, kano types and directions
+            if columnKey not in sample['columns']:
+                sample['columns'][columnKey] = sample['preferences'] @ column
+                if len(sample['columns']) > self.maxColumns:
+                    sample['columns'].popitem(last=False)
+            sample['columns'].move_to_end(columnKey)
+            columns.append(sample['columns'][columnKey])
+        self.evict()
+        return np.column_stack(columns) if columns else np.empty((len(sample['preferences']), 0))
+
+    def nbytes(self):
+        return sum(sample['preferences'].nbytes + sum(column.nbytes for column in sample['columns'].values())
+                   for sample in self.samples.values())
+
+    def evict(self): # least recently used samples first, until the rest fit
+        while self.samples and self.nbytes() > self.maxBytes:
+            self.samples.popitem(last=False)
+
+
+class ChoiceEngine: # array-backed consumers, each buys its best product when the one it owns wears out
+    def __init__(self, population, transform, lifespans, monthsPerTick, rng=np.random, chunkSize=CHUNK_SIZE, utilities=None):
+        self.population = population
+        self.preferences = population.preferences # consumers x attributes
+        self.transform = transform # attributes x products
+        self.choices = None if utilities is None else utilities.argmax(axis=1) # with cached utilities every consumer's pick is known up front
+        self.bestUtility = None # utility of each consumer's pick, kept once market events are scheduled, see track
+        self.available = np.ones(transform.shape[1], dtype=bool) # products on the market
+        self.lifespans = lifespans # lifespan of each product
+        self.monthsPerTick = monthsPerTick
+        self.rng = rng # global numpy random state unless the simulation is seeded
+        self.chunkSize = chunkSize
+        self.ownedProductRemainingLifespan = population.ownedProductRemainingLifespan
+        self.bestProducer = population.bestProducer
+        self.salesType = int if population.weights is None else float # weighted agents sell fractional units
+        if population.weights is not None:
+            self.groupSales = np.zeros((population.groups.max() + 1, len(lifespans))) # replicates x products, for the error estimate
+
+    def purchase(self, buyers): # buyers pick their top product and draw how long it lasts
+        sales = np.zeros(len(self.lifespans), dtype=self.salesType)
+        weights = self.population.weights
+        for start in range(0, len(buyers), self.chunkSize):
+            chunk = buyers[start:start + self.chunkSize]
+            if not self.available.all(): # consumers with nothing left on the market try again next tick
+                chunk = chunk[self.bestUtility[chunk] > -np.inf]
+            chosen = self.choose(chunk)
+            self.ownedProductRemainingLifespan[chunk] = self.lifespans[chosen] - self.draw(chunk)
+            self.bestProducer[chunk] = chosen
+            if weights is None:
+                sales += np.bincount(chosen, minlength=len(self.lifespans))
+            else: # each agent buys for the consumers it represents
+                sales += np.bincount(chosen, weights[chunk], minlength=len(self.lifespans))
+                self.groupSales += np.bincount(self.population.groups[chunk] * len(self.lifespans) + chosen, weights[chunk],
+                                               minlength=self.groupSales.size).reshape(self.groupSales.shape)
+        return sales
+
+    def draw(self, consumers): # how much sooner than its lifespan each purchase wears out
+        return self.rng.exponential(size=len(consumers))
+
+    def choose(self, consumers): # top product of each consumer
+        if self.choices is not None:
+            return self.choices[consumers]
+        return (self.preferences[consumers] @ self.transform).argmax(axis=1) # argmax keeps the first product on ties, like max() over the result dict
+
+    def rescan(self, consumers): # best available product of these consumers over every product
+        utilities = self.preferences[consumers] @ self.transform
+        utilities[:, ~self.available] = -np.inf
+        self.choices[consumers] = chosen = utilities.argmax(axis=1)
+        self.bestUtility[consumers] = np.take_along_axis(utilities, chosen[:, None], axis=1)[:, 0]
+
+    def track(self): # starts keeping every consumer's best product and its utility, so market events can update them incrementally
+        if self.bestUtility is not None:
+            return
+        self.choices = np.zeros(len(self.preferences), dtype=np.intp)
+        self.bestUtility = np.empty(len(self.preferences))
+        for chunk in self.population.chunks(self.chunkSize):
+            self.rescan(chunk)
+
+    def updateProduct(self, product, column=None, available=None): # a product's transform column or availability changed
+        self.track()
+        if column is not None:
+            self.transform[:, product] = column
+        if available is not None:
+            self.available[product] = available
+        for chunk in self.population.chunks(self.chunkSize):
+            utility = self.preferences[chunk] @ self.transform[:, product] if self.available[product] else np.full(chunk.stop - chunk.start, -np.inf)
+            choices, bestUtility = self.choices[chunk], self.bestUtility[chunk] # views, updated in place
+            holders = choices == product
+            worse = holders & (utility < bestUtility) # their pick got worse, another product may now be better
+            better = ~holders & ((utility > bestUtility) | ((utility == bestUtility) & (product < choices))) # ties go to the first product, like argmax
+            kept = holders & ~worse
+            bestUtility[kept] = utility[kept]
+            choices[better] = product
+            bestUtility[better] = utility[better]
+            self.rescan(chunk.start + np.flatnonzero(worse)) # the only full rescans, every other consumer compared one column
+
+    def step(self): # advances every consumer one tick, returns sales per product
+        sales = np.zeros(len(self.lifespans), dtype=self.salesType)
+        for chunk in self.population.chunks(self.chunkSize):
+            remaining = self.ownedProductRemainingLifespan[chunk] # a view, updated in place
+            owners = remaining > 0
+            remaining[owners] -= self.monthsPerTick
+
+            buyers = chunk.start + np.flatnonzero(~owners) # only consumers whose product expired make a choice
+            sales += self.purchase(buyers)
+        return sales
+
+    def events(self, ticks): # event-driven version of calling step() every tick, yields sales per product for each tick
+        queue = {0: [np.arange(len(self.preferences))]} # tick of next purchase -> consumers, a bucketed priority queue
+        for i in range(ticks):
+            due = queue.pop(i, [])
+            buyers = np.sort(np.concatenate(due)) if due else np.empty(0, dtype=int) # consumer order, so random draws match step()
+            sales = self.purchase(buyers)
+
+            # step() decrements the remaining lifespan once per tick and buys on the first tick it is no longer positive
+            waits = np.maximum(0, np.ceil(self.ownedProductRemainingLifespan[buyers] / self.monthsPerTick)).astype(int)
+            order = np.argsort(waits, kind='stable')
+            buyers = buyers[order]
+            nextTicks, starts = np.unique(i + 1 + waits[order], return_index=True)
+            ends = np.append(starts[1:], len(buyers))
+            for tick, start, end in zip(nextTicks.tolist(), starts.tolist(), ends.tolist()):
+                if tick < ticks:
+                    queue.setdefault(tick, []).append(buyers[start:end])
+            yield sales
+
+    def close(self): # nothing to release, see ShardedEngine.close
+        pass
+
+
+class LoggingChoiceEngine(ChoiceEngine): # ChoiceEngine that also writes every purchase to a PurchaseLog, so runs without a log pay nothing for it
+    def __init__(self, *args, log, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = log
+        self.tick = 0 # tick of the purchases being made
+
+    def choose(self, consumers):
+        utilities = self.preferences[consumers] @ self.transform
+        utilities[:, ~self.available] = -np.inf
+        chosen = utilities.argmax(axis=1) if self.choices is None else self.choices[consumers] # one product, as ChoiceEngine.choose picks it
+        best = np.take_along_axis(utilities, chosen[:, None], axis=1)[:, 0]
+        np.put_along_axis(utilities, chosen[:, None], -np.inf, axis=1)
+        margins = best - utilities.max(axis=1) if utilities.shape[1] > 1 else np.full(len(best), np.inf) # over the runner-up
+        weights = self.population.weights
+        self.log.write(self.tick, consumers, chosen, margins, 1 if weights is None else weights[consumers])
+        return chosen
+
+    def step(self):
+        sales = super().step()
+        self.tick += 1
+        return sales
+
+    def events(self, ticks):
+        for sales in super().events(ticks):
+            yield sales
+            self.tick += 1
+
+    def close(self):
+        self.log.close()
+
+
+class CommonDrawEngine(ChoiceEngine): # ChoiceEngine drawing from one set of draws per tick, so engines stepped side by side share them
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.draws = None # one draw per consumer for the current tick, set before each step
+
+    def draw(self, consumers):
+        return self.draws[consumers]
+
+
+class Product: # sales are recorded in Simulation.timeSeries, see getMarketShares and getSalesData
+    def __init__(self, valueList, name):
+        self.name = name
+        self.profit = 0 # total profit accumulated for new product (starting with no profit)
+        self.price = valueList[1]  # The price of the product
+        self.productioncost = 0
+        self.valueList = valueList
+        self.lifespan = float(valueList[0]) 
+        self.remainingLifespan = 0
+
+
+
+
+class Attribute:
+    def __init__(self, name, kano, direction, stdev, weight): # data table columns, product attributes
+        self.name = name
+        self.kanotype = kano
+        self.direction = direction
+        self.stdev = stdev
+        self.weight = weight
+
+    def setkanotype(self, type):
+        self.kanotype = type
+
+
+class TimeSeries: # ticks x products sales and revenue, preallocated and filled in place
+    def __init__(self, ticks, productNames, prices, monthsPerTick, dtype=np.int64):
+        self.productNames = list(productNames)
+        self.prices = np.asarray(prices, dtype=float)
+        self.months = np.arange(ticks) * monthsPerTick
+        self.sales = np.zeros((ticks, len(self.productNames)), dtype=dtype)
+        self.revenue = np.zeros((ticks, len(self.productNames)))
+        self.ticks = 0 # ticks recorded so far
+
+    def record(self, salesPerProduct):
+        self.sales[self.ticks] = salesPerProduct
+        np.multiply(salesPerProduct, self.prices, out=self.revenue[self.ticks])
+        self.ticks += 1
+
+    def getSales(self, cumulative=False): # views of the recorded ticks, cumulative totals come from one cumsum
+        sales = self.sales[:self.ticks]
+        return sales.cumsum(axis=0) if cumulative else sales
+
+    def getRevenue(self, cumulative=False):
+        revenue = self.revenue[:self.ticks]
+        return revenue.cumsum(axis=0) if cumulative else revenue
+
+    def toDataFrame(self, values): # months x products, sharing memory with values
+        import pandas as pd
+        return pd.DataFrame(values, index=pd.Index(self.months[:len(values)], name='Time (Months)'), columns=self.productNames, copy=False)
+
+    def save(self, path): # compact binary export, read back with load
+        np.savez_compressed(path, months=self.months[:self.ticks], sales=self.getSales(), revenue=self.getRevenue(),
+                            prices=self.prices, productNames=np.array(self.productNames))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            series = cls(len(data['months']), data['productNames'].tolist(), data['prices'], 0)
+            series.months = data['months']
+            series.sales = data['sales']
+            series.revenue[:] = data['revenue']
+            series.ticks = len(data['months'])
+        return series
+
+
+class Simulation:
+    def __init__(self, table, consumers, months, cost, monthsPerTick, scheduler='tick', seed=None, run=True,
+                 dtype=np.float64, chunkSize=CHUNK_SIZE, populationPath=None, sampling='random', agents=AGENTS, replicates=REPLICATES,
+                 processes=SHARD_PROCESSES, cache=None, events=None, purchaseLog=None):
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"scheduler must be one of {SCHEDULERS}, got {scheduler!r}")
+        if sampling not in SAMPLINGS:
+            raise ValueError(f"sampling must be one of {SAMPLINGS}, got {sampling!r}")
+        if sampling == 'stratified' and agents < MIN_AGENTS:
+            raise ValueError(f"stratified sampling needs at least {MIN_AGENTS} agents, got {agents!r}")
+        if sampling == 'stratified' and replicates < MIN_REPLICATES:
+            raise ValueError(f"stratified sampling needs at least {MIN_REPLICATES} replicates, got {replicates!r}")
+
+        self.df = table
+        self.consumers = consumers  # number of consumers
+        self.months = months  # number of months in simulation
+        self.cost = cost
+        self.monthsPerTick = monthsPerTick
+        self.ticks = int(months/monthsPerTick) # prevents non integer months
+        self.rng = np.random if seed is None else np.random.default_rng(seed) # a seed makes the run reproducible
+
+        self.profitPerSale = unitProfit(self.df.iat[1, 5], self.cost) # profit calculation
+        self.tickProfitPerSale = np.full(self.ticks, self.profitPerSale) # changes when the new product's price does
+        self.marketEvents = {} # tick -> [(kind, product index, attribute row, value)], see schedule
+
+        self.attributeDF = self.df.iloc[:, 0:5] # splits data table into attributes dataframe
+
+        self.productDF = self.df.iloc[:, 5:] # splits data table into product dataframe
+
+        with timed('setup'):
+            self.setAttributes() # set attributes
+            self.setProducts() # set producers
+            transform = transformMatrix(self.productDF, self.df['Kanotype'], self.df['Direction'])
+
+        self.sampling = sampling
+        if sampling == 'stratified' or events or purchaseLog or multiprocessing.current_process().daemon: # daemonic job workers cannot start processes
+            processes = 1
+        processes = max(1, min(processes, consumers // MIN_SHARD))
+        if seed is None or sampling == 'stratified' or populationPath is not None or processes > 1:
+            cache = None # only seeded in-memory samples can be reused
+        sample = None
+        with timed('sampling', consumers=consumers, cached=0) as info:
+            if cache is not None:
+                key = SampleCache.key(seed, consumers, dtype, self.df['Spread'], self.df['Weight'])
+                sample = cache.get(key)
+            if sample is not None: # an earlier run drew these preferences, continue its generator from there
+                info['cached'] = 1
+                self.rng.bit_generator.state = sample['state']
+                self.population = Population(consumers, len(self.df), dtype, preferences=sample['preferences'])
+            elif sampling == 'stratified': # a few hundred weighted agents stand in for the whole market
+                self.population = Population(agents, len(self.df), dtype, populationPath)
+                self.population.sampleStratified(self.df['Spread'], self.df['Weight'], self.rng, min(replicates, agents // 2), consumers)
+            else:
+                self.population = Population(consumers, len(self.df), dtype, populationPath, processes > 1) # float32 and a populationPath keep very large markets in bounds
+                self.population.sample(self.df['Spread'], self.df['Weight'], self.rng, chunkSize) # for amount of customers specified
+                if cache is not None:
+                    sample = cache.put(key, self.population.preferences, self.rng.bit_generator.state)
+
+        self.timeSeries = TimeSeries(self.ticks, self.productDF.columns, self.productDF.iloc[1].values, self.monthsPerTick,
+                                     np.int64 if self.population.weights is None else float) # every product, every tick
+        lifespans = np.array([product.lifespan for product in self.products])
+        if processes > 1: # consumer shards stepped in parallel, with the same results as one process
+            self.engine = ShardedEngine(self.population, transform, lifespans, self.monthsPerTick, self.rng, chunkSize, processes)
+        else:
+            utilities = None if sample is None else cache.utilities(sample, transform) # only edited product columns are recomputed
+            if purchaseLog is None:
+                self.engine = ChoiceEngine(self.population, transform, lifespans, self.monthsPerTick, self.rng, chunkSize, utilities)
+            else: # a PurchaseLog, or a path to write one to
+                log = purchaseLog if isinstance(purchaseLog, PurchaseLog) else PurchaseLog(purchaseLog, productNames=self.productDF.columns)
+                self.engine = LoggingChoiceEngine(self.population, transform, lifespans, self.monthsPerTick, self.rng, chunkSize, utilities,
+                                                  log=log)
+
+        self.scheduler = scheduler
+        for event in events or []:
+            self.schedule(**event)
+        if run:
+            self.run()
+
+    def schedule(self, month, kind, product, value=None, attribute=None): # market event before the purchases of that month, e.g. a competitor's price cut
+        if kind not in MARKET_EVENTS:
+            raise ValueError(f"kind must be one of {MARKET_EVENTS}, got {kind!r}")
+        if not isinstance(self.engine, ChoiceEngine):
+            raise ValueError("market events need a single-process simulation, pass processes=1")
+        names = list(self.productDF.columns)
+        if product not in names and not (isinstance(product, int) and 0 <= product < len(names)):
+            raise ValueError(f"product must be one of {names} or an index, got {product!r}")
+        index = names.index(product) if product in names else product
+        row = None
+        if kind == 'price':
+            row = 1 # the table's second row is always the price
+        elif kind == 'change':
+            attributes = list(self.df['Attribute'])
+            if attribute not in attributes:
+                raise ValueError(f"attribute must be one of {attributes}, got {attribute!r}")
+            row = attributes.index(attribute)
+
+        tick = max(0, math.ceil(month / self.monthsPerTick))
+        if kind == 'launch' and tick > 0: # off the market until its launch
+            self.marketEvents.setdefault(0, []).append(('withdraw', index, None, None))
+        if tick < self.ticks:
+            self.marketEvents.setdefault(tick, []).append((kind, index, row, value))
+
+    def applyEvents(self, tick): # events scheduled for this tick, in the order they were scheduled
+        for kind, index, row, value in self.marketEvents.pop(tick, []):
+            if kind in ('launch', 'withdraw'):
+                self.engine.updateProduct(index, available=kind == 'launch')
+                continue
+            product = self.products[index]
+            product.valueList = values = np.array(product.valueList, dtype=float)
+            values[row] = value = float(value)
+            if row == 0:
+                product.lifespan = self.engine.lifespans[index] = value
+            elif row == 1:
+                product.price = self.timeSeries.prices[index] = value
+                if index == 0:
+                    self.tickProfitPerSale[tick:] = unitProfit(value, self.cost)
+            column = [kanoTransform(v, kanotype, direction) for v, kanotype, direction in zip(values, self.df['Kanotype'], self.df['Direction'])]
+            self.engine.updateProduct(index, column=np.array(column, dtype=float)) # one utility column, not consumers x products
+
+    def stream(self, every=1): # runs the simulation, yielding a snapshot every `every` ticks and after the last one
+        if self.scheduler == 'event':
+            tickSales = self.engine.events(self.ticks) # run time scales with purchases rather than consumers x ticks
+        else:
+            tickSales = (self.engine.step() for _ in range(self.ticks))
+
+        elapsed, start = 0, time.perf_counter() # time spent in the tick loop, not in whoever consumes the snapshots
+        try:
+            self.applyEvents(0)
+            for i, salesPerProduct in enumerate(tickSales): # loop that runs every tick
+                self.timeSeries.record(salesPerProduct) # every consumer with an expired product picks the top product in one batch
+                self.applyEvents(i + 1) # the next tick's purchases only run when the loop asks for them
+                if (i + 1) % every == 0 or i + 1 == self.ticks:
+                    elapsed += time.perf_counter() - start
+                    yield self.getSnapshot()
+                    start = time.perf_counter()
+        finally: # also when the run is abandoned part way, e.g. a cancelled job
+            self.engine.close()
+        record('ticks', elapsed, consumers=self.consumers, ticks=self.ticks, consumerTicks=self.population.consumers * self.ticks)
+
+    def run(self): # runs every tick without building intermediate snapshots
+        for _ in self.stream(every=max(self.ticks, 1)):
+            pass
+
+    def getSnapshot(self): # state of the run after the latest tick
+        tick = self.timeSeries.ticks - 1
+        sales = self.timeSeries.getSales() # ticks so far x products
+        return {
+            'tick': tick,
+            'ticks': self.ticks,
+            'month': tick*self.monthsPerTick,
+            'profit': (sales[:, 0] @ self.tickProfitPerSale[:tick + 1]).item(),
+            'tickProfit': (sales[-1, 0] * self.tickProfitPerSale[tick]).item(),
+            'sales': dict(zip(self.timeSeries.productNames, sales.sum(axis=0).tolist())),
+        }
+
+    def setAttributes(self):
+        attributes = []
+        for _, row in self.attributeDF.iterrows():
+            attribute = None
+            if not None in row.values:
+                attribute = Attribute(*row.values)
+            debug(attribute)
+            attributes.append(attribute)
+        self.attributes = attributes
+
+    def setProducts(self):
+        products = []
+        for col in self.productDF:
+            values = self.productDF[col]
+            products.append(Product(values.values, col))
+        self.products = products
+
+    def getProfitData(self): # dict with time and profit for graphing
+        profit = (self.timeSeries.getSales()[:, 0] * self.tickProfitPerSale[:self.timeSeries.ticks]).cumsum()
+        return {'Time (Months)': self.timeSeries.months[:len(profit)].tolist(), 'Profit ($)': profit.tolist()}
+
+    def getNonCumulativeProfitData(self): # dict with time and non cumulative profit for graphing
+        sales = self.timeSeries.getSales()[:, 0]
+        return {'Time (Months)': self.timeSeries.months[:len(sales)].tolist(), 'Profit ($)': (sales * self.tickProfitPerSale[:len(sales)]).tolist()}
+
+    def getShareError(self): # standard error of each market share across the stratified replicates, None for random sampling
+        import pandas as pd
+        if self.population.weights is None:
+            return None
+        groupSales = self.engine.groupSales
+        shares = groupSales / np.maximum(groupSales.sum(axis=1, keepdims=True), 1e-12)
+        stdError = shares.std(axis=0, ddof=1) / math.sqrt(len(shares))
+        z, dof = NormalDist().inv_cdf(0.975), len(shares) - 1 # Student t quantile, the replicates are few
+        t = T_QUANTILES.get(dof, z + (z ** 3 + z) / (4 * dof) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)) # Cornish-Fisher from 8 on
+        total = self.timeSeries.getSales().sum(axis=0)
+        return pd.DataFrame({'Product Name': self.timeSeries.productNames, 'Market Share': total / max(total.sum(), 1e-12),
+                             'Std Error': stdError, '95% Error': t * stdError})
+
+    def getSalesData(self, cumulative=False): # months x products DataFrame of units sold
+        return self.timeSeries.toDataFrame(self.timeSeries.getSales(cumulative))
+
+    def getRevenueData(self, cumulative=False): # months x products DataFrame of sales times price
+        return self.timeSeries.toDataFrame(self.timeSeries.getRevenue(cumulative))
+
+    def getMarketShares(self):
+        import pandas as pd
+        ms = {'Product Name': list(self.timeSeries.productNames), 'Sales': self.timeSeries.getSales().sum(axis=0).tolist()}
+        df = pd.DataFrame(ms)
+        return df
+
+
+def runReplication(args): # one seeded run, top level so the process pool can pickle it
+    table, consumers, months, cost, monthsPerTick, seed = args
+    sim = Simulation(table, consumers, months, cost, monthsPerTick, seed=seed)
+    return list(sim.getMarketShares()['Sales']), sim.getProfitData()['Profit ($)'], sim.getNonCumulativeProfitData()['Profit ($)']
+
+
+class Replications: # independent seeded runs of one scenario, summarized as mean and percentile bands
+    def __init__(self, table, consumers, months, cost, monthsPerTick, replications, seed=None, processes=None, percentiles=(5, 50, 95)):
+        self.percentiles = percentiles
+        self.months = [i*monthsPerTick for i in range(int(months/monthsPerTick))]
+        self.productNames = list(table.columns[5:])
+
+        seeds = np.random.SeedSequence(seed).spawn(replications) # every run gets its own independent Generator stream
+        tasks = [(table, consumers, months, cost, monthsPerTick, s) for s in seeds]
+        if processes == 1:
+            runs = list(map(runReplication, tasks))
+        else:
+            with ProcessPoolExecutor(processes) as pool: # runs are independent, so they spread across cores
+                runs = list(pool.map(runReplication, tasks))
+
+        self.sales = np.array([run[0] for run in runs]) # replications x products
+        self.profit = np.array([run[1] for run in runs]).reshape(replications, -1) # replications x ticks
+        self.noncumulativeProfit = np.array([run[2] for run in runs]).reshape(replications, -1)
+
+    def bands(self, values):
+        import pandas as pd
+        df = {'Time (Months)': self.months, 'Profit ($)': values.mean(axis=0)}
+        for p, band in zip(self.percentiles, np.percentile(values, self.percentiles, axis=0)):
+            df[f'P{p}'] = band
+        return pd.DataFrame(df)
+
+    def getProfitBands(self):
+        return self.bands(self.profit)
+
+    def getNonCumulativeProfitBands(self):
+        return self.bands(self.noncumulativeProfit)
+
+    def getMarketShareIntervals(self):
+        import pandas as pd
+        shares = self.sales / np.maximum(self.sales.sum(axis=1, keepdims=True), 1)
+        ms = {'Product Name': self.productNames, 'Sales': self.sales.mean(axis=0), 'Market Share': shares.mean(axis=0)}
+        for p, interval in zip(self.percentiles, np.percentile(shares, self.percentiles, axis=0)):
+            ms[f'P{p}'] = interval
+        return pd.DataFrame(ms)
+
+
+SCALARS = ['consumers', 'months', 'cost', 'monthsPerTick'] # scenario settings a variant can override
+
+
+class BatchEvaluator: # evaluates many variants of one scenario in a single batched pass with common random numbers
+    def __init__(self, table, consumers, months, cost, monthsPerTick, seed=None):
+        self.df = table
+        self.productDF = table.iloc[:, 5:].astype(float) # fractional overrides go into float columns
+        self.productNames = list(self.productDF.columns)
+        self.attributeNames = list(table['Attribute'])
+        self.base = {'consumers': consumers, 'months': months, 'cost': cost, 'monthsPerTick': monthsPerTick}
+
+        preferenceSeed, self.drawSeed = np.random.SeedSequence(seed).spawn(2)
+        self.preferences = samplePreferences(table['Spread'], table['Weight'], consumers, np.random.default_rng(preferenceSeed)) # drawn once, shared by every variant
+
+    def variant(self, overrides): # product values and scenario settings with some cells or scalars replaced
+        productDF = self.productDF.copy()
+        settings = dict(self.base)
+        for parameter, value in overrides.items():
+            if parameter in SCALARS:
+                settings[parameter] = value
+            elif isinstance(parameter, tuple) and len(parameter) == 2:
+                attribute, product = parameter
+                if attribute not in self.attributeNames or product not in self.productNames:
+                    raise ValueError(f"no table cell for attribute {attribute!r} and product {product!r}")
+                productDF.iat[self.attributeNames.index(attribute), self.productNames.index(product)] = value
+            else:
+                raise ValueError(f"parameter must be one of {SCALARS} or an (attribute, product) pair, got {parameter!r}")
+        if settings['consumers'] > len(self.preferences):
+            raise ValueError(f"variants can use at most {len(self.preferences)} consumers")
+        return productDF, settings
+
+    def evaluate(self, variants): # total sales per product and new product profit for each variant
+        variants = [self.variant(overrides) for overrides in variants]
+        transforms = np.array([transformMatrix(productDF, self.df['Kanotype'], self.df['Direction']) for productDF, _ in variants]) # variants x attributes x products
+        utilities = np.einsum('na,vap->vnp', self.preferences, transforms) # products are fixed during a run, so each choice is too
+        engines = [CommonDrawEngine(Population(settings['consumers'], len(self.df), preferences=self.preferences[:settings['consumers']]),
+                                    transform, np.asarray(productDF.iloc[0].values, dtype=float), float(settings['monthsPerTick']),
+                                    utilities=variantUtilities[:settings['consumers']])
+                   for (productDF, settings), transform, variantUtilities in zip(variants, transforms, utilities)]
+        ticks = [int(settings['months']/settings['monthsPerTick']) for _, settings in variants]
+
+        rng = np.random.default_rng(self.drawSeed) # same draws on every call, so repeated evaluations stay comparable
+        sales = np.zeros((len(variants), transforms.shape[2]), dtype=int)
+        for i in range(max(ticks, default=0)):
+            draws = rng.exponential(size=len(self.preferences)) # one draw per consumer per tick, common to every variant
+            for variant, (engine, variantTicks) in enumerate(zip(engines, ticks)):
+                if i < variantTicks:
+                    engine.draws = draws
+                    sales[variant] += engine.step()
+
+        profitPerSale = np.array([unitProfit(productDF.iat[1, 0], settings['cost']) for productDF, settings in variants])
+        return sales, sales[:, 0] * profitPerSale
+
+
+def sweep(table, consumers, months, cost, monthsPerTick, parameter, values, seed=None): # tidy table of sales, market share and profit for every grid value
+    import pandas as pd
+    values = list(values)
+    if parameter == 'consumers':
+        consumers = max(values) # smaller populations reuse the first consumers of the largest one
+    evaluator = BatchEvaluator(table, consumers, months, cost, monthsPerTick, seed)
+    sales, profit = evaluator.evaluate([{parameter: value} for value in values])
+
+    shares = sales / np.maximum(sales.sum(axis=1, keepdims=True), 1)
+    rows = []
+    for value, variantSales, variantShares, variantProfit in zip(values, sales, shares, profit):
+        for idx, name in enumerate(evaluator.productNames):
+            rows.append({'Value': value, 'Product Name': name, 'Sales': variantSales[idx], 'Market Share': variantShares[idx],
+                         'Profit ($)': variantProfit if idx == 0 else np.nan}) # profit is only known for the new product
+    return pd.DataFrame(rows)
+
+
+OPTIMIZER_EVALUATIONS = 400 # candidate designs scored by optimizeNewProduct
+
+OPTIMIZER_WIDENINGS = 3 # times the default price cap may double while the best design sits on it
+
+OPTIMIZER_BATCH = 32 # candidates scored in one BatchEvaluator pass, bounds its variants x consumers arrays
+
+optimizerEvaluator = None # BatchEvaluator of an optimizer worker process, see initOptimizer
+
+
+def initOptimizer(*args): # every worker samples the same consumers and draws from the shared seed
+    global optimizerEvaluator
+    optimizerEvaluator = BatchEvaluator(*args)
+
+
+def evaluateDesigns(candidates): # top level so the process pool can pickle it
+    return optimizerEvaluator.evaluate(candidates)[1]
+
+
+def optimizeNewProduct(table, consumers, months, cost, monthsPerTick, seed=None, attributes=None, priceBounds=None, attributeCosts=None,
+                       maxEvaluations=OPTIMIZER_EVALUATIONS, processes=1, progress=None): # coordinate search for the most profitable new product
+    import pandas as pd
+    product = table.columns[5]
+    names = list(table['Attribute'])
+    attributes = names[2:] if attributes is None else list(attributes) # the lifespan and price rows are not 0-10 scores
+    price = float(table.iat[1, 5])
+    keys = [(attribute, product) for attribute in attributes] + [(names[1], product)]
+    priceLow, priceHigh = priceBounds if priceBounds else (cost, max(3 * price, cost + 1))
+    resolution = np.array([0.1] * len(attributes) + [1.0]) # score tenths and whole dollars, like the table
+    low = np.ceil((np.array([0.0] * len(attributes) + [priceLow]) / resolution).round(6)) * resolution # on the grid, so every candidate is a table value
+    high = np.floor((np.array([10.0] * len(attributes) + [priceHigh]) / resolution).round(6)) * resolution
+    if low[-1] > high[-1]:
+        raise ValueError(f"price bounds must include a whole dollar price, got {priceLow!r} to {priceHigh!r}")
+    costs = np.array([(attributeCosts or {}).get(attribute, 0) for attribute in attributes]) # extra unit cost per score point
+
+    def snap(x):
+        return np.clip(np.round(x / resolution) * resolution, low, high).round(6)
+
+    def overrides(x):
+        return dict(zip(keys, x.tolist()), cost=cost + float(costs @ x[:-1]))
+
+    seed = np.random.SeedSequence(seed).entropy # one seed for every worker, so all candidates share consumers and draws
+    settings = (table, consumers, months, cost, monthsPerTick, seed)
+    if multiprocessing.current_process().daemon: # daemonic job workers cannot start processes
+        processes = 1
+    pool = ProcessPoolExecutor(processes, initializer=initOptimizer, initargs=settings) if processes > 1 else None
+    evaluator = BatchEvaluator(*settings) if pool is None else None
+    history = {} # candidate -> profit, every candidate is scored once
+
+    def score(candidates):
+        candidates = list({tuple(x.tolist()): x for x in candidates if tuple(x.tolist()) not in history}.values())
+        batches = [candidates[start:start + OPTIMIZER_BATCH] for start in range(0, len(candidates), OPTIMIZER_BATCH)]
+        if pool is None:
+            profits = [evaluator.evaluate([overrides(x) for x in batch])[1] for batch in batches]
+        else: # each batch is split across the workers
+            parts = [[overrides(x) for x in part] for batch in batches for part in np.array_split(np.array(batch), processes) if len(part)]
+            profits = list(pool.map(evaluateDesigns, parts))
+        for x, profit in zip(candidates, np.concatenate(profits) if profits else []):
+            history[tuple(x.tolist())] = float(profit)
+
+    try:
+        x = snap(np.array([float(table.loc[table['Attribute'] == attribute].iat[0, 5]) for attribute in attributes] + [price]))
+        score([x])
+        step = (high - low) / 4
+        widenings = 0 if priceBounds is None else OPTIMIZER_WIDENINGS
+        while len(history) < maxEvaluations:
+            if widenings < OPTIMIZER_WIDENINGS and x[-1] >= high[-1]: # the default price cap is only a guess, raised while the best design sits on it
+                widenings += 1
+                high[-1] *= 2
+                step[-1] = max(step[-1], (high[-1] - low[-1]) / 4)
+            if not (step >= resolution).any():
+                break
+            candidates = []
+            for i in np.flatnonzero(step >= resolution): # both directions along every coordinate still being searched
+                for sign in (1, -1):
+                    y = x.copy()
+                    y[i] = x[i] + sign * step[i]
+                    candidates.append(snap(y))
+            score(candidates)
+            best = max((tuple(y.tolist()) for y in candidates), key=history.get)
+            if history[best] > history[tuple(x.tolist())]:
+                x = np.array(best) # keep the step while it pays off
+            else:
+                step = step / 2
+            if progress is not None:
+                progress(min(len(history) / maxEvaluations, 1))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    design = dict(zip(attributes + [names[1]], x.tolist()))
+    rows = [dict(zip(attributes + [names[1]], candidate), **{'Profit ($)': profit}) for candidate, profit in history.items()]
+    capped = bool(x[-1] >= high[-1]) # the best price is the highest one searched, a higher price may be more profitable
+    return design, history[tuple(x.tolist())], pd.DataFrame(rows), capped
+
+
+SNAPSHOTS = 50 # partial results reported over the course of a streamed run
+
+
+def getResults(sim): # plain data for charting and caching, also valid part way through a run
+    results = {
+        'marketShares': sim.getMarketShares().to_dict('list'),
+        'profit': sim.getProfitData(),
+        'noncumulativeProfit': sim.getNonCumulativeProfitData(),
+    }
+    shareError = sim.getShareError()
+    if shareError is not None: # stratified runs report how far the shares may be from a full run
+        results['shareError'] = shareError.to_dict('list')
+    return results
+
+
+def runScenario(table, columns, consumers, months, cost, monthsPerTick, seed=None, progress=None, agents=None, processes=SHARD_PROCESSES,
+                cache=None, events=None, purchaseLog=None): # runs a table from the app, reporting partial results to progress(fraction, results)
+    import pandas as pd
+    with timed('table'):
+        df = pd.DataFrame.from_records(table, columns=columns)
+        debug(df)
+    sampling = 'random' if not agents else 'stratified' # agents sets the size of the representative sample
+    sim = Simulation(df, consumers, int(months), cost, monthsPerTick, seed=seed, run=False, sampling=sampling, agents=agents or AGENTS,
+                     processes=processes, cache=cache, events=events, purchaseLog=purchaseLog)
+    for snapshot in sim.stream(every=max(1, sim.ticks // SNAPSHOTS)):
+        if progress is not None:
+            progress((snapshot['tick'] + 1) / snapshot['ticks'], getResults(sim))
+    return getResults(sim)
+
+
+def optimizeScenario(table, columns, consumers, months, cost, monthsPerTick, seed=None, progress=None, **kwargs): # runScenario on the most profitable new product found
+    import pandas as pd
+    df = pd.DataFrame.from_records(table, columns=columns)
+    for column in columns[3:]: # scores arrive as strings from the app's table
+        df[column] = pd.to_numeric(df[column])
+    search = None if progress is None else (lambda fraction: progress(0.8 * fraction)) # the search is most of the work
+    design, profit, _, capped = optimizeNewProduct(df, consumers, int(months), cost, monthsPerTick, seed, progress=search)
+
+    table = [dict(row) for row in table]
+    for row in table:
+        if row[columns[0]] in design:
+            row[columns[5]] = design[row[columns[0]]]
+    results = runScenario(table, columns, consumers, months, cost, monthsPerTick, seed,
+                          None if progress is None else (lambda fraction, partial: progress(0.8 + 0.2 * fraction, partial)), **kwargs)
+    results['design'] = design
+    results['priceCapped'] = capped
+    return results